@@ -10,6 +10,7 @@ setuptools.setup(
     author_email="roma57linux@gmail.com",
     packages=["simpleparser"],
     tests_require=["test.py"],
+    extras_require={"numba": ["numba"], "re2": ["google-re2"]},
     description="Simple library with simple parser which parses simple expressions.",
     long_description=long_description,
     long_description_content_type="text/markdown",
@@ -1,10 +1,77 @@
 from __future__ import annotations
 
-from copy import deepcopy
-from math import inf
-from typing import Iterable, Final, Set, Callable, List, Union, Tuple, Any, Literal, Optional
-
-import re as regex
+import operator as op
+import re
+import weakref
+from functools import lru_cache
+from math import inf, isfinite
+from types import MappingProxyType
+from typing import Iterable, Final, Callable, List, Union, Tuple, Any, Literal, Optional, Dict
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+_NUMBA_OPERATORS: Final = {
+    op.add: "(({}) + ({}))", op.sub: "(({}) - ({}))", op.mul: "(({}) * ({}))", op.truediv: "(({}) / ({}))",
+    op.pow: "(({}) ** ({}))", op.mod: "(({}) % ({}))",
+    op.eq: "(({}) == ({}))", op.ne: "(({}) != ({}))", op.ge: "(({}) >= ({}))", op.gt: "(({}) > ({}))",
+    op.le: "(({}) <= ({}))", op.lt: "(({}) < ({}))", op.not_: "(not ({}))",
+}
+"""Templates of python source for operators functions which numba can compile."""
+
+
+def _numba_template(func: Callable) -> Optional[str]:
+    """Template of python source for the operator function if numba can compile it, None otherwise."""
+    try:
+        return _NUMBA_OPERATORS.get(func)
+    except TypeError:  # unhashable function cannot be one of the known ones
+        return None
+
+
+def _literal(value: Any) -> Optional[str]:
+    """Python source of the value if it is a number or boolean which can be written as literal, None otherwise."""
+    if type(value) in (int, bool) or type(value) is float and isfinite(value):
+        try:
+            return repr(value)
+        except ValueError:  # int is too large to be converted to string, see `sys.set_int_max_str_digits`
+            return None
+    return None
+
+
+def _compile_constant_regexp(regexp: str, use_re2: bool):
+    """Compiles regexp with re2 if it is requested, installed and supports the regexp, with `re` otherwise."""
+    if use_re2 and re2 is not None:
+        try:
+            return re2.compile(regexp)
+        except re2.error:
+            pass
+    return re.compile(regexp)
+
+
+def _trie_pattern(trie: Dict[Optional[str], Any]) -> str:
+    """
+    Builds regular expression which matches the longest string stored in the trie.
+    Trie is nested dicts by characters, None key marks the end of stored string.
+    """
+    leaves = [re.escape(char) for char, node in trie.items() if char is not None and node.keys() == {None}]
+    alternatives = [re.escape(char) + _trie_pattern(node) for char, node in trie.items()
+                    if char is not None and node.keys() != {None}]
+    if len(leaves) > 1:
+        alternatives.append(f"[{''.join(leaves)}]")
+    else:
+        alternatives += leaves
+    if not alternatives:
+        return ""
+    pattern = alternatives[0] if len(alternatives) == 1 else f"(?:{'|'.join(alternatives)})"
+    # optional continuation is greedy, so the longest string is matched
+    return f"(?:{pattern})?" if None in trie else pattern
 
 
 class ParseError(ValueError):
@@ -43,9 +110,20 @@ class Operator:
 class ConstantType:
     """Structure for storing different types of constant tokens such numbers of booleans."""
 
-    def __init__(self, regexp: str, to_value: Callable[[str], Any]):
+    def __init__(self, regexp: str, to_value: Callable[[str], Any], first_chars: Optional[str] = None,
+                 use_re2: bool = False):
+        """
+        :param regexp: regular expression which matches whole constant token.
+        :param to_value: function which converts token to the constant value.
+        :param first_chars: characters which constant token can start with. If given, tokens starting with
+            other characters are not matched against `regexp` at all. None means any character.
+        :param use_re2: match `regexp` with re2 in linear time if it is installed and supports `regexp`.
+            Note that re2's `\\d`, `\\w` and `\\s` match only ASCII characters unlike `re`'s.
+        """
         self.regexp = regexp
         self.to_value = to_value
+        self.first_chars = first_chars
+        self.use_re2 = use_re2
 
 
 # tokens structs
@@ -88,168 +166,258 @@ Token: Final = Union[VariableToken, BraceToken, OperatorToken, ConstantToken]
 
 
 class ParsedExpression:
+    _COMPILE_AFTER_CALLS: Final = 8
+    """Expression is interpreted this number of times before compiling it to python function."""
+
     def __init__(self, operations: List[Tuple[Operator, Tuple[int | VariableToken]]],
-                 precalculated: Optional[List[Any]]):
+                 precalculated: Optional[Iterable[Any]]):
         """
         :param operations: each tuple is pair of operator and its arguments which are variable names or indexes of one of previous calculations which result uses as argument
         """
         self.operations = operations
-        if precalculated is None:
-            precalculated = []
-        self.precalculated = precalculated
+        # constants are shared by all calls, so they are stored immutable
+        self.precalculated: Tuple[Any, ...] = tuple(precalculated) if precalculated is not None else ()
+        self._n_pre = len(self.precalculated)
+        self._variables: List[str] = list(dict.fromkeys(
+            arg.name for _, args in operations for arg in args if isinstance(arg, VariableToken)))
+        # evaluation stack consists of precalculated values, variables values and then results of operations,
+        # operations are also stored as parallel arrays of functions and their arguments indexes in the stack,
+        # None second argument means the operator is unary
+        self._n_vars = len(self._variables)
+        variables_indexes = {name: self._n_pre + i for i, name in enumerate(self._variables)}
+        arguments_indexes = [[variables_indexes[arg.name] if isinstance(arg, VariableToken)
+                              else arg if arg < self._n_pre else arg + self._n_vars for arg in args]
+                             for _, args in operations]
+        self._funcs: List[Callable] = [operator.func for operator, _ in operations]
+        self._arg_a: List[int] = [indexes[0] for indexes in arguments_indexes]
+        self._arg_b: List[Optional[int]] = [indexes[1] if len(indexes) > 1 else None for indexes in arguments_indexes]
+        self._calls_count: int = 0
+        self._compiled: Optional[Callable[[Dict[str, Any]], Any]] = None
 
     def __call__(self, **kwargs):
-        calc_stack = deepcopy(self.precalculated)
-        for operation in self.operations:
-            calc_stack.append(operation[0].func(
-                *(calc_stack[param] if isinstance(param, int) else kwargs[param.name] for param in operation[1])))
+        if self._compiled is None:
+            self._calls_count += 1
+            if self._calls_count <= self._COMPILE_AFTER_CALLS:
+                return self._evaluate(kwargs)
+            try:
+                self._compiled = self._compile()
+            except Exception:
+                # generated code is only an optimization, the expression is interpreted if it cannot be compiled
+                self._compiled = self._evaluate
+        return self._compiled(kwargs)
+
+    def compile_numba(self) -> bool:
+        """
+        Compiles the expression to machine code using numba, if it is installed and all the operators and constants
+        of the expression are supported by numba (arithmetic and comparison operators of `Defaults`, numbers and
+        booleans). Compiled expression accepts only values of numba-supported types.
+
+        :return: True if the expression is compiled, False otherwise.
+        """
+        if numba is None or not self.operations \
+                or not all(_numba_template(func) is not None for func in self._funcs) \
+                or not all(_literal(value) is not None for value in self.precalculated):
+            return False
+        namespace: Dict[str, Any] = {}
+        lines = self._generate_body(namespace, lambda i, arguments: _numba_template(self._funcs[i]).format(*arguments))
+        parameters = ", ".join(f"_v{i}" for i in range(len(self._variables)))
+        exec(compile(f"def _expression({parameters}):\n" + "\n".join(lines), "<simpleparser>", "exec"), namespace)
+        kernel = numba.njit(namespace["_expression"])
+        variables = self._variables
+        self._compiled = lambda kwargs: kernel(*[kwargs[name] for name in variables])
+        return True
+
+    def _compile(self) -> Callable[[Dict[str, Any]], Any]:
+        """Generates python function which calculates the expression taking dictionary of variables values."""
+        if not self.precalculated and not self.operations:
+            return self._evaluate
+        namespace: Dict[str, Any] = {f"_f{i}": func for i, func in enumerate(self._funcs)}
+        lines = [f"    _v{i} = _kwargs[{name!r}]" for i, name in enumerate(self._variables)]
+        lines += self._generate_body(namespace, lambda i, arguments: f"_f{i}({', '.join(arguments)})")
+        exec(compile("def _expression(_kwargs):\n" + "\n".join(lines), "<simpleparser>", "exec"), namespace)
+        return namespace["_expression"]
+
+    def _generate_body(self, namespace: Dict[str, Any], operation_source: Callable[[int, List[str]], str]) -> List[str]:
+        """
+        Generates source lines of function which calculates the expression and returns the result.
+
+        :param namespace: globals of the generated function, constants which cannot be literals are added here.
+        :param operation_source: takes index of operation and sources of its arguments, returns source of operation.
+        Variables have to be stored in `_v0`, `_v1`... local variables in order of `self._variables`.
+        """
+        values: List[str] = []
+        """Sources of values in the evaluation stack."""
+        for i, value in enumerate(self.precalculated):
+            values.append(_literal(value))
+            if values[-1] is None:
+                namespace[f"_c{i}"] = value
+                values[-1] = f"_c{i}"
+        values += (f"_v{i}" for i in range(self._n_vars))
+        lines = []
+        for i, (a, b) in enumerate(zip(self._arg_a, self._arg_b)):
+            arguments = [values[arg] for arg in (a, b) if arg is not None]
+            lines.append(f"    _s{i} = {operation_source(i, arguments)}")
+            values.append(f"_s{i}")
+        lines.append(f"    return {values[-1]}")
+        return lines
+
+    def _evaluate(self, kwargs: Dict[str, Any]) -> Any:
+        # the stack is created per call to keep evaluation reentrant and thread-safe,
+        # constants are copied by reference only and hot expressions are compiled with constants inlined
+        calc_stack = [*self.precalculated, *[kwargs[name] for name in self._variables]]
+        append = calc_stack.append
+        for func, a, b in zip(self._funcs, self._arg_a, self._arg_b):
+            if b is None:
+                append(func(calc_stack[a]))
+            else:
+                append(func(calc_stack[a], calc_stack[b]))
         return calc_stack[-1]
 
 
 class Parser:
     def __init__(self, operators: Iterable[Operator], constants: Iterable[ConstantType] = []):
-        self.operators = set(operators)
-        self.constants = constants
-        self.operators_signs = {}
-        for operator in operators:
-            self.operators_signs |= {sign: operator for sign in operator.signs}
-        self.operators_names = {operator.name: operator for operator in operators}
+        self.operators = tuple(operators)
+        self.constants = tuple(constants)
+        self.operators_signs = MappingProxyType(
+            {sign: operator for operator in self.operators for sign in operator.signs})
+        self.operators_names = MappingProxyType({operator.name: operator for operator in self.operators})
+        self._sign_first_chars = frozenset(sign[0] for sign in self.operators_signs if sign)
+        sign_trie: Dict[Optional[str], Any] = {}
+        for sign in self.operators_signs:
+            node = sign_trie
+            for char in sign:
+                node = node.setdefault(char, {})
+            node[None] = sign
+        signs_pattern = _trie_pattern(sign_trie)
+        if signs_pattern:
+            # anything else up to a whitespace, a brace or a beginning of some sign is a name or a constant,
+            # only characters which can start a sign have to be checked with lookahead
+            first_chars = re.escape("".join(sorted(self._sign_first_chars)))
+            self._lexer = re.compile(
+                rf"{signs_pattern}|[()]|(?:[^\s(){first_chars}]|(?!{signs_pattern})[{first_chars}])+")
+        else:
+            self._lexer = re.compile(r"[()]|[^\s()]+")
+        # tokens which don't depend on context are created once, braces take precedence over names and names over signs
+        self._fixed_tokens: Dict[str, Token] = {
+            **{sign: OperatorToken(operator) for sign, operator in self.operators_signs.items()},
+            **{name: OperatorToken(operator) for name, operator in self.operators_names.items()},
+            "(": BraceToken(BraceToken.OPEN),
+            ")": BraceToken(BraceToken.CLOSE),
+        }
+        # the cache refers to the parser weakly, so it doesn't make a reference cycle and is freed with the parser
+        parser_ref = weakref.ref(self)
+        self._parse_cached = lru_cache(maxsize=1024)(lambda s: parser_ref().parse(s))
+        compiled_constants = [(_compile_constant_regexp(const_type.regexp, const_type.use_re2), const_type.to_value,
+                               const_type.first_chars) for const_type in self.constants]
+        # constant types which have to be checked for a token are looked up by token's first character,
+        # keeping the order in which constant types were given
+        self._constants_any = [(pattern, to_value) for pattern, to_value, first_chars in compiled_constants
+                               if first_chars is None]
+        self._constants_by_char = {
+            char: [(pattern, to_value) for pattern, to_value, first_chars in compiled_constants
+                   if first_chars is None or char in first_chars]
+            for char in "".join(first_chars for _, _, first_chars in compiled_constants if first_chars is not None)
+        }
+
+    def parse_cached(self, s: str) -> ParsedExpression:
+        """
+        Parse expression. The same `ParsedExpression` is returned for recently parsed strings.
+
+        Returned expressions are shared objects: they count their calls and compile themselves (see `compile_numba`
+        too) per instance, so compiling one of them affects every user of the same string.
+        """
+        return self._parse_cached(s)
 
     def to_token(self, token: str) -> Token:
-        if token == "(":
-            return BraceToken(BraceToken.OPEN)
-        if token == ")":
-            return BraceToken(BraceToken.CLOSE)
-        if token in self.operators_names:
-            return OperatorToken(self.operators_names[token])
-        if token in self.operators_signs:
-            return OperatorToken(self.operators_signs[token])
+        fixed_token = self._fixed_tokens.get(token)
+        if fixed_token is not None:
+            return fixed_token
         if token:
-            for const_type in self.constants:
-                if regex.match(const_type.regexp, token):
-                    return ConstantToken(const_type.to_value(token))
+            for pattern, to_value in self._constants_by_char.get(token[0], self._constants_any):
+                if pattern.match(token):
+                    return ConstantToken(to_value(token))
             return VariableToken(token)
 
     def split(self, s: str) -> List[Token]:
         """Lexical analysis of expression, splits boolean expression to tokens."""
-        ret: List[Token] = []
-
-        def append_token(t: str):
-            if not t.isspace() and t:
-                ret.append(self.to_token(t))
-
-        current_token: str = ""
-        for c in s + " ":
-            if c.isspace() or c in "()":
-                append_token(current_token)
-                append_token(c)
-                current_token = ""
-            elif current_token in self.operators_signs:
-                if current_token + c in self.operators_signs:
-                    current_token += c
-                else:
-                    append_token(current_token)
-                    current_token = c
-            else:
-                current_token += c
-                for sign in self.operators_signs:
-                    if current_token[-len(sign):] == sign:
-                        append_token(current_token[:-len(sign)])
-                        current_token = sign
-                        break
-        return ret
+        return list(map(self.to_token, self._lexer.findall(s)))
 
     def parse(self, s: str) -> ParsedExpression:
-        """Parse expression."""
+        """Parse expression using shunting-yard algorithm."""
         tokens = self.split(s)
-        open_braces: int = 0
-        close_braces: int = 0
-        operators_data: List[Tuple[int, int]] = []
-        # each pair in `operators_data` is number of open braces before operator considering closed braces
-        # and position of operator in tokens without braces
-        variables: Set[VariableToken] = set()
-        precalculated = []
-        tokens_without_braces: List[OperatorToken | VariableToken | int] = []
-        """Set of names of all variables."""
-        for i in range(len(tokens)):
-            if isinstance(tokens[i], BraceToken):
-                if tokens[i].which == BraceToken.OPEN:
-                    open_braces += 1
-                else:
-                    close_braces += 1
-                    if open_braces - close_braces < 0:
-                        raise ParseError("Cannot parse the expression: close brace without open.")
-            elif isinstance(tokens[i], OperatorToken):
-                operators_data.append((open_braces - close_braces, i - (open_braces + close_braces)))
-                tokens_without_braces.append(tokens[i])
-            elif isinstance(tokens[i], VariableToken):
-                variables.add(tokens[i])
-                tokens_without_braces.append(tokens[i])
-            elif isinstance(tokens[i], ConstantToken):
-                precalculated.append(tokens[i].value)
-                tokens_without_braces.append(len(precalculated) - 1)
-        if open_braces - close_braces:
-            raise ParseError("Cannot parse the expression: not all open braces have pair close brace.")
-
-        calculation_order = [operator_data[1] for operator_data in
-                             sorted(operators_data,
-                                    key=lambda data:
-                                    # data[0] is number of open braces: as more open braces as much priority
-                                    # the second number is operator priority
-                                    # data[1] is position of operator in tokens without braces list
-                                    (data[0], -tokens_without_braces[data[1]].operator.priority, -data[1]),
-                                    reverse=True)]
-        operators_with_arguments: List[Tuple[Operator, Tuple[int, ] | Tuple[int, int]]] = []
-
-        def update_last_calc(operator_index: int, side: Literal[-1, 1], calculation_index: int):
-            old_value = tokens_without_braces[operator_index + side]
-            i = operator_index + side
-            while i < len(tokens_without_braces) and tokens_without_braces[i] == old_value:
-                tokens_without_braces[i] = calculation_index
-                i += side
-
-        for calculation_index in range(len(calculation_order)):
-            operator_index = calculation_order[calculation_index]
-            operator = tokens_without_braces[operator_index].operator
-            if operator.type == 1:
-                operators_with_arguments.append((operator, (tokens_without_braces[operator_index + 1],)))
-                update_last_calc(operator_index, 1, calculation_index + len(precalculated))
-            elif operator.type == 2:
-                operators_with_arguments.append(
-                    (operator, (tokens_without_braces[operator_index - 1], tokens_without_braces[operator_index + 1])))
-                update_last_calc(operator_index, 1, calculation_index + len(precalculated))
-                update_last_calc(operator_index, -1, calculation_index + len(precalculated))
-            tokens_without_braces[operator_index] = calculation_index + len(precalculated)
-        return ParsedExpression(operators_with_arguments, precalculated)
+        precalculated = [token.value for token in tokens if isinstance(token, ConstantToken)]
+        constants_count: int = 0
+        operations: List[Tuple[Operator, Tuple[int | VariableToken, ...]]] = []
+        operands: List[int | VariableToken] = []
+        """Indexes of calculated values or variables which are not used as arguments yet."""
+        operators_stack: List[Optional[Operator]] = []
+        """Operators waiting for their right operand to be calculated, None is an open brace."""
+
+        def calculate(operator: Operator):
+            if len(operands) < operator.type:
+                raise ParseError(f"Cannot parse the expression: operator {operator} has not enough operands.")
+            arguments = tuple(operands[-operator.type:])
+            del operands[-operator.type:]
+            operands.append(len(precalculated) + len(operations))
+            operations.append((operator, arguments))
+
+        for token in tokens:
+            if isinstance(token, ConstantToken):
+                operands.append(constants_count)
+                constants_count += 1
+            elif isinstance(token, VariableToken):
+                operands.append(token)
+            elif isinstance(token, OperatorToken):
+                operator = token.operator
+                if operator.type == 2:
+                    # all operators are left-associative, so operators with the same priority are calculated first
+                    priority = operator.priority
+                    while operators_stack and (top := operators_stack[-1]) is not None and top.priority <= priority:
+                        calculate(operators_stack.pop())
+                operators_stack.append(operator)
+            elif token.which == BraceToken.OPEN:
+                operators_stack.append(None)
+            else:
+                while operators_stack and operators_stack[-1] is not None:
+                    calculate(operators_stack.pop())
+                if not operators_stack:
+                    raise ParseError("Cannot parse the expression: close brace without open.")
+                operators_stack.pop()
+        while operators_stack:
+            operator = operators_stack.pop()
+            if operator is None:
+                raise ParseError("Cannot parse the expression: not all open braces have pair close brace.")
+            calculate(operator)
+        return ParsedExpression(operations, precalculated)
 
 
 class Defaults:
-    pow = Operator("pow", 2, lambda a, p: a ** p, ("^", "**"), 0)
-    div = Operator("div", 2, lambda a, b: a / b, ("/",), 1)
-    mod = Operator("mod", 2, lambda a, b: a % b, ("%",), 1)
-    mul = Operator("mul", 2, lambda a, b: a * b, ("*",), 1)
-    plus = Operator("plus", 2, lambda a, b: a + b, ("+",), 2)
-    minus = Operator("minus", 2, lambda a, b: a - b, ("-",), 2)
-
-    eq = Operator("eq", 2, lambda a, b: a == b, ("==", "\u21D4", "\u2261", "\u27F7"), 3)
-    not_eq = Operator("not_eq", 2, lambda a, b: a != b, ("!=", "<>"), 3)
-    great_eq = Operator("great_eq", 2, lambda a, b: a >= b, (">=",), 3)
-    great = Operator("great", 2, lambda a, b: a > b, (">",), 3)
-    less_eq = Operator("less_eq", 2, lambda a, b: a <= b, ("<=",), 3)
-    less = Operator("less", 2, lambda a, b: a < b, ("<",), 3)
-
-    not_op = Operator("not", 1, lambda a: not a, ("!", "~", "\u00AC"), 4)
+    pow = Operator("pow", 2, op.pow, ("^", "**"), 0)
+    div = Operator("div", 2, op.truediv, ("/",), 1)
+    mod = Operator("mod", 2, op.mod, ("%",), 1)
+    mul = Operator("mul", 2, op.mul, ("*",), 1)
+    plus = Operator("plus", 2, op.add, ("+",), 2)
+    minus = Operator("minus", 2, op.sub, ("-",), 2)
+
+    eq = Operator("eq", 2, op.eq, ("==", "\u21D4", "\u2261", "\u27F7"), 3)
+    not_eq = Operator("not_eq", 2, op.ne, ("!=", "<>"), 3)
+    great_eq = Operator("great_eq", 2, op.ge, (">=",), 3)
+    great = Operator("great", 2, op.gt, (">",), 3)
+    less_eq = Operator("less_eq", 2, op.le, ("<=",), 3)
+    less = Operator("less", 2, op.lt, ("<",), 3)
+
+    not_op = Operator("not", 1, op.not_, ("!", "~", "\u00AC"), 4)
     and_op = Operator("and", 2, lambda a, b: a and b, ("&&", "\u22C0"), 5)
     or_op = Operator("or", 2, lambda a, b: a or b, ("||", "\u22C1"), 6)
     impl = Operator("impl", 2, lambda a, b: not a or b, ("->", "\u21D2", "\u2192"), 7)
 
-    integers_decimal = ConstantType(r"[0-9]{1,}$", int)
-    integers_binary = ConstantType(r"0b[0-1]{1,}$", lambda s: int(s, 2))
-    integers_hex = ConstantType(r"0x[0-F]{1,}$", lambda s: int(s, 16))
+    integers_decimal = ConstantType(r"[0-9]{1,}$", int, "0123456789")
+    integers_binary = ConstantType(r"0b[0-1]{1,}$", lambda s: int(s, 2), "0")
+    integers_hex = ConstantType(r"0x[0-9A-Fa-f]{1,}$", lambda s: int(s, 16), "0")
 
-    float_point = ConstantType(r"([0-9]{0,}\.?[0-9]{1,}|[0-9]{1,}\.)((e|E)[0-9]{1,})?$", float)
+    float_point = ConstantType(r"([0-9]{0,}\.?[0-9]{1,}|[0-9]{1,}\.)((e|E)[0-9]{1,})?$", float, ".0123456789")
 
-    boolean = ConstantType(r"(True|False|true|false)$", lambda s: True if s in {"True", "true"} else False)
+    boolean = ConstantType(r"(True|False|true|false)$", lambda s: True if s in {"True", "true"} else False, "TtFf")
 
     # TODO better priority implementation
 
@@ -1,4 +1,9 @@
 import unittest
+import weakref
+from types import SimpleNamespace
+from unittest import mock
+
+import simpleparser.simpleparser
 from simpleparser.simpleparser import *
 
 
@@ -22,6 +27,73 @@ class ParserTest(unittest.TestCase):
         self.assertEqual(expr1(a=4.0), 1 + 4.0 / 2.0)
         expr2 = Defaults.parser.parse("0b10+4e5^(0x8F/10+a*.07)")
         self.assertEqual(expr2(a=0.7), 0b10 + 4e5 ** (0x8F / 10 + 0.7 * .07))
+        expr3 = Defaults.parser.parse("0xff + 0x1A")
+        self.assertEqual(expr3(), 0xff + 0x1A)
+        self.assertIsInstance(Defaults.parser.to_token("0x:"), VariableToken)
+
+    def test_compiled(self):
+        expr = Defaults.parser.parse("x.y * (z - 0.5) >= 2 || !flag")
+        for i in range(3 * ParsedExpression._COMPILE_AFTER_CALLS):
+            self.assertEqual(expr(**{"x.y": i, "z": i / 3, "flag": i % 2 == 0}), i * (i / 3 - 0.5) >= 2 or i % 2 != 0)
+        with self.assertRaises(KeyError):
+            expr(z=1, flag=True)
+
+    def test_long(self):
+        expr = Defaults.parser.parse(" - ".join(["a"] * 10000) + " * (b + 1)")
+        self.assertEqual(expr(a=1, b=1), 1 - 9998 - 2)
+
+    def test_compiled_huge_constant(self):
+        huge = int("f" * 4000, 16)  # too many decimal digits to be written as python literal
+        expr = Defaults.parser.parse(f"0x{'f' * 4000} + a")
+        for a in range(3 * ParsedExpression._COMPILE_AFTER_CALLS):
+            self.assertEqual(expr(a=a), huge + a)
+
+    def test_compile_numba(self):
+        # numba.njit is replaced by identity, so the generated function is run as plain python
+        with mock.patch.object(simpleparser.simpleparser, "numba", SimpleNamespace(njit=lambda func: func)):
+            negative = ConstantType(r"n[0-9]+$", lambda s: -int(s[1:]), "n")
+            parser = Parser([Defaults.pow, Defaults.plus, Defaults.less, Defaults.not_op], [negative])
+            for source in ["n5 ^ a", "a ^ n2 + n5", "!(n5 ^ a < a)"]:
+                interpreted = parser.parse(source)
+                compiled = parser.parse(source)
+                self.assertTrue(compiled.compile_numba())
+                for a in range(1, 4):
+                    self.assertEqual(compiled(a=a), interpreted._evaluate({"a": a}))
+            self.assertFalse(Defaults.parser.parse("a && b").compile_numba())
+            self.assertFalse(Defaults.parser.parse(f"0x{'f' * 4000} + a").compile_numba())
+            unhashable_func = type("Unhashable", (), {"__call__": max, "__hash__": None})()
+            unhashable = Operator("unhashable", 2, unhashable_func, ("@",))
+            self.assertFalse(Parser([unhashable]).parse("a @ b").compile_numba())
+
+    def test_re2(self):
+        class Re2Error(Exception):
+            pass
+
+        def re2_compile(regexp):
+            if "(?!" in regexp:  # like re2, the stub doesn't support lookarounds
+                raise Re2Error(regexp)
+            return re2_pattern
+
+        re2_pattern = SimpleNamespace(match=lambda token: token == "re2")
+        re2_stub = SimpleNamespace(compile=re2_compile, error=Re2Error)
+        with mock.patch.object(simpleparser.simpleparser, "re2", re2_stub):
+            accepted = ConstantType(r"\d+$", lambda s: s, use_re2=True)
+            self.assertIsInstance(Parser([], [accepted]).to_token("re2"), ConstantToken)
+            self.assertIsInstance(Parser([], [accepted]).to_token("\u0663"), VariableToken)
+            rejected = ConstantType(r"(?!0)\d+$", int, use_re2=True)
+            self.assertEqual(Parser([], [rejected]).to_token("\u0663").value, 3)
+            default = ConstantType(r"\d+$", int)
+            self.assertEqual(Parser([], [default]).to_token("\u0663").value, 3)
+
+    def test_parse_cached(self):
+        expr = Defaults.parser.parse_cached("a + b * 2")
+        self.assertIs(Defaults.parser.parse_cached("a + b * 2"), expr)
+        self.assertEqual(expr(a=1, b=3), 7)
+        parser = Parser([Defaults.plus])
+        parser.parse_cached("a + b")
+        parser_ref = weakref.ref(parser)
+        del parser  # no reference cycle, so the parser is freed without the garbage collector
+        self.assertIsNone(parser_ref())
 
     def test_deep(self):
         self.assertEqual(str(Defaults.parser.split("(True&&a->!False)||8>=8&&8<9")), str([
@@ -43,11 +115,11 @@ class ParserTest(unittest.TestCase):
             ConstantToken(9),
         ]))  # not comparing actual values here because Token.__eq__ is not defined
         parsed = Defaults.parser.parse("(True&&a->!False)||8>=8&&8<9")
-        self.assertEqual(parsed.precalculated, [True, False, 8, 8, 8, 9])
+        self.assertEqual(parsed.precalculated, (True, False, 8, 8, 8, 9))
         self.assertEqual(str(parsed.operations), str([
-            (Defaults.not_op, (1,)),                        # 6 (5 precalculated + 1st operation)
-            (Defaults.and_op, (0, VariableToken("a"))),     # 7
-            (Defaults.impl, (7, 6)),                        # 8
+            (Defaults.and_op, (0, VariableToken("a"))),     # 6 (5 precalculated + 1st operation)
+            (Defaults.not_op, (1,)),                        # 7
+            (Defaults.impl, (6, 7)),                        # 8
             (Defaults.great_eq, (2, 3)),                    # 9
             (Defaults.less, (4, 5)),                        # 10
             (Defaults.and_op, (9, 10)),                     # 11